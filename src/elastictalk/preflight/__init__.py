@@ -0,0 +1,72 @@
+import typing
+from concurrent import futures
+
+
+DEFAULT_MAX_WORKERS = 8
+OK = 'OK'
+FAILED = 'FAILED'
+SKIPPED = 'SKIPPED'
+
+
+class PreflightError(Exception):
+    pass
+
+
+class PreflightSkip(Exception):
+    '''
+    Raise in a check which cannot verify anything, it neither passes nor
+    fails the preflight
+    '''
+
+
+class Preflight:
+    '''
+    Read only check batch, it runs all checks at once and collects every
+    failure instead of breaking on the first one like Pipe.
+    '''
+
+    def __init__(
+            self,
+            checks: typing.Dict[str, typing.Callable],
+            max_workers: int = DEFAULT_MAX_WORKERS,
+    ):
+        """
+        Give checks as {name: check}, a check raises on failure, raises
+        PreflightSkip when it cannot check and may return a message to show
+        on success
+        """
+        self.checks = checks
+        self.max_workers = max_workers
+
+    def run(self) -> typing.Dict[str, typing.Tuple[str, str]]:
+        results = dict()
+        if not self.checks:
+            return results
+        with futures.ThreadPoolExecutor(
+                max_workers=min(self.max_workers, len(self.checks))
+        ) as executor:
+            running = {
+                name: executor.submit(check)
+                for name, check in self.checks.items()
+            }
+            for name, future in running.items():
+                try:
+                    results[name] = (OK, future.result() or '')
+                except PreflightSkip as skip:
+                    results[name] = (SKIPPED, str(skip))
+                except Exception as error:
+                    results[name] = (FAILED, str(error))
+        return results
+
+    def start(self):
+        results = self.run()
+        for name, (status, message) in results.items():
+            print(f'[{status}] {name}: {message}')
+        failed = [
+            name
+            for name, (status, _) in results.items()
+            if status == FAILED
+        ]
+        if failed:
+            raise PreflightError(f'Preflight failed on {failed}')
+        return results
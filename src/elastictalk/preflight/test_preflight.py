@@ -0,0 +1,57 @@
+import io
+import time
+import unittest
+import contextlib
+from .. import preflight
+
+
+def passing_check():
+    time.sleep(0.2)
+    return 'passed'
+
+
+def failing_check():
+    time.sleep(0.2)
+    raise Exception('failed')
+
+
+def skipped_check():
+    raise preflight.PreflightSkip('skipped')
+
+
+class PreflightTest(unittest.TestCase):
+    def test_run_checks_at_once(self):
+        started = time.monotonic()
+        results = preflight.Preflight({
+            'first': passing_check,
+            'second': passing_check,
+            'third': failing_check,
+        }).run()
+        self.assertLess(time.monotonic() - started, 0.5)
+        self.assertEqual(results, {
+            'first': (preflight.OK, 'passed'),
+            'second': (preflight.OK, 'passed'),
+            'third': (preflight.FAILED, 'failed'),
+        })
+
+    def test_start_reports_every_failure(self):
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            with self.assertRaises(preflight.PreflightError) as error:
+                preflight.Preflight({
+                    'first': failing_check,
+                    'second': failing_check,
+                    'third': passing_check,
+                }).start()
+        self.assertIn("['first', 'second']", str(error.exception))
+        self.assertIn('[OK] third: passed', output.getvalue())
+
+    def test_skipped_check_does_not_fail(self):
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            results = preflight.Preflight({
+                'passing': passing_check,
+                'skipped': skipped_check,
+            }).start()
+        self.assertEqual(results['skipped'], (preflight.SKIPPED, 'skipped'))
+        self.assertIn('[SKIPPED] skipped: skipped', output.getvalue())
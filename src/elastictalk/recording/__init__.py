@@ -0,0 +1,300 @@
+import re
+import json
+import time
+import typing
+import datetime
+import threading
+import collections
+import importlib
+from .. import utils
+
+
+RECORDING_HANDLER_ID = 'elastictalk-recording'
+REDACTED = 'REDACTED'
+ENVIRONMENT_NAMESPACE = 'aws:elasticbeanstalk:application:environment'
+# SSM parameter fields kept in recordings, Value is redacted and the rest
+# like SourceResult of Secrets Manager references is dropped
+SSM_PARAMETER_FIELDS = ['Name', 'Selector', 'Version']
+# utils.now_string default format
+NOW_STRING_PATTERN = r'\d{4}-\d{2}-\d{2}-\d{2}-\d{2}-\d{2}'
+NOW_STRING_PLACEHOLDER = 'NOW'
+# Modules sleeping between polls, replay scales their sleeps with the latency
+POLLING_MODULES = [
+    'botocore.waiter',
+    'ebcli.operations.commonops',
+]
+
+
+class ReplayError(Exception):
+    pass
+
+
+class RecordingEncoder(json.JSONEncoder):
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return {'__datetime__': o.isoformat()}
+        if isinstance(o, bytes):
+            return o.decode('utf-8', errors='replace')
+        return str(o)
+
+
+def decode_recording_object(obj: dict):
+    if '__datetime__' in obj:
+        return datetime.datetime.fromisoformat(obj['__datetime__'])
+    return obj
+
+
+def get_operation_key(model) -> typing.Tuple[str, str]:
+    return model.service_model.service_name, model.name
+
+
+def get_recording_params(params: dict) -> dict:
+    return json.loads(
+        json.dumps(params, cls=RecordingEncoder),
+        object_hook=decode_recording_object,
+    )
+
+
+def redact_value(value: str) -> str:
+    '''
+    Keep database URL shape and plain cache addresses for the address
+    rewrites on replay, drop everything else
+    '''
+    if 'cache.amazonaws.com' in str(value) and '@' not in str(value):
+        return value
+    db_info = re.match(utils.DB_URL_PATTERN, str(value))
+    if not db_info:
+        return REDACTED
+    scheme, _, _ = db_info['connection_info'].rpartition('://')
+    scheme = f'{scheme}://' if scheme else ''
+    return (
+        f'{scheme}{REDACTED}:{REDACTED}'
+        f'@{db_info["address"]}:{db_info["port_slash_db"]}'
+    )
+
+
+def redact(obj, service_name: str):
+    '''
+    Replace SSM parameter values and EB environment variable values in
+    params or parsed response, recordings must not hold secrets
+    '''
+    if isinstance(obj, list):
+        return [redact(item, service_name) for item in obj]
+    if not isinstance(obj, dict):
+        return obj
+    if service_name == 'ssm' and 'Name' in obj and 'Value' in obj:
+        parameter = {
+            key: obj[key]
+            for key in SSM_PARAMETER_FIELDS
+            if key in obj
+        }
+        parameter['Value'] = redact_value(obj['Value'])
+        return parameter
+    obj = {key: redact(value, service_name) for key, value in obj.items()}
+    if 'Value' in obj and obj.get('Namespace') == ENVIRONMENT_NAMESPACE:
+        obj['Value'] = redact_value(obj['Value'])
+    return obj
+
+
+def strip_timestamps(obj):
+    '''
+    Drop datetime params like ebcli's events StartTime and mask ids made by
+    utils.now_string like snapshot ids, they differ on every run
+    '''
+    if isinstance(obj, list):
+        return [strip_timestamps(item) for item in obj]
+    if isinstance(obj, dict):
+        return {
+            key: strip_timestamps(value)
+            for key, value in obj.items()
+            if not isinstance(value, datetime.datetime)
+        }
+    if isinstance(obj, str):
+        return re.sub(NOW_STRING_PATTERN, NOW_STRING_PLACEHOLDER, obj)
+    return obj
+
+
+def load_records(record_file: str) -> typing.List[dict]:
+    with open(record_file) as f:
+        return [
+            json.loads(line, object_hook=decode_recording_object)
+            for line in f
+            if line.strip()
+        ]
+
+
+class Recorder:
+    '''
+    Append every botocore request and parsed response with its start offset
+    and elapsed seconds to record_file as JSON lines, secrets are redacted.
+    '''
+
+    def __init__(self, record_file: str):
+        self.record_file = record_file
+        self.started = time.time()
+        self._lock = threading.Lock()
+        # Truncate the previous recording
+        open(self.record_file, 'w').close()
+
+    def attach(self, events):
+        events.register(
+            'before-parameter-build',
+            self.before_parameter_build,
+            unique_id=f'{RECORDING_HANDLER_ID}-before-parameter-build',
+        )
+        events.register(
+            'after-call',
+            self.after_call,
+            unique_id=f'{RECORDING_HANDLER_ID}-after-call',
+        )
+
+    def before_parameter_build(self, params, model, context, **kwargs):
+        context[RECORDING_HANDLER_ID] = {
+            'params': get_recording_params(params),
+            'started': time.time(),
+        }
+
+    def after_call(self, http_response, parsed, model, context, **kwargs):
+        request = context.get(RECORDING_HANDLER_ID)
+        if request is None:
+            return
+        service_name, operation_name = get_operation_key(model)
+        record = {
+            'service': service_name,
+            'operation': operation_name,
+            'params': redact(request['params'], service_name),
+            'status_code': http_response.status_code,
+            'response': redact(parsed, service_name),
+            'started_at': request['started'] - self.started,
+            'elapsed': time.time() - request['started'],
+        }
+        line = json.dumps(record, cls=RecordingEncoder)
+        with self._lock:
+            with open(self.record_file, 'a') as f:
+                f.write(line)
+                f.write('\n')
+
+
+class ReplayHTTPResponse:
+    def __init__(self, status_code: int):
+        self.status_code = status_code
+        self.headers = dict()
+        self.content = b''
+
+
+class ScaledTime:
+    '''
+    Stand-in of the time module with sleeps scaled by latency_scale
+    '''
+
+    def __init__(self, latency_scale: float):
+        self.latency_scale = latency_scale
+
+    def __getattr__(self, name):
+        return getattr(time, name)
+
+    def sleep(self, seconds: float):
+        time.sleep(seconds * self.latency_scale)
+
+
+class Replayer:
+    '''
+    Serve recorded responses instead of calling AWS, the first recorded
+    call of the operation with the same params wins so concurrent calls
+    replay deterministically, timestamps are ignored when no params match
+    exactly. Calls without a recorded match fail and are listed by report.
+    Latencies are kept with latency_scale=1 or compressed with a smaller
+    scale.
+    '''
+
+    def __init__(self, record_file: str, latency_scale: float = 1.0):
+        self.record_file = record_file
+        self.latency_scale = latency_scale
+        self.records = load_records(record_file)
+        self.queues = collections.defaultdict(collections.deque)
+        for record in self.records:
+            self.queues[(record['service'], record['operation'])].append(
+                record
+            )
+        self.replayed = 0
+        self.unmatched = list()
+        self.started = time.time()
+        self._lock = threading.Lock()
+
+    def attach(self, events):
+        events.register(
+            'before-parameter-build',
+            self.before_parameter_build,
+            unique_id=f'{RECORDING_HANDLER_ID}-before-parameter-build',
+        )
+        events.register(
+            'before-call',
+            self.before_call,
+            unique_id=f'{RECORDING_HANDLER_ID}-before-call',
+        )
+
+    def scale_polling_sleep(self):
+        for module_name in POLLING_MODULES:
+            module = importlib.import_module(module_name)
+            module.time = ScaledTime(self.latency_scale)
+
+    def before_parameter_build(self, params, model, context, **kwargs):
+        # Recorded params are redacted, compare with redacted params
+        context[RECORDING_HANDLER_ID] = redact(
+            get_recording_params(params),
+            get_operation_key(model)[0],
+        )
+
+    def before_call(self, model, params, context, **kwargs):
+        key = get_operation_key(model)
+        api_params = context.get(RECORDING_HANDLER_ID)
+        with self._lock:
+            queue = self.queues[key]
+            record = next(
+                (record for record in queue if record['params'] == api_params),
+                None,
+            )
+            if record is None:
+                record = next(
+                    (
+                        record
+                        for record in queue
+                        if strip_timestamps(record['params']) ==
+                        strip_timestamps(api_params)
+                    ),
+                    None,
+                )
+            if record is None:
+                # Pipe only logs job errors, keep them for the report
+                self.unmatched.append(f'{key[0]}:{key[1]} {api_params}')
+                raise ReplayError(
+                    f'No recorded {key[0]}:{key[1]} call with params '
+                    f'{api_params} in {self.record_file}'
+                )
+            queue.remove(record)
+            self.replayed += 1
+        time.sleep(record['elapsed'] * self.latency_scale)
+        return ReplayHTTPResponse(record['status_code']), record['response']
+
+    @property
+    def recorded_duration(self) -> float:
+        return max(
+            (record['started_at'] + record['elapsed'] for record in self.records),
+            default=0,
+        )
+
+    def report(self) -> bool:
+        '''
+        Print the replay summary, return False when calls were not matched
+        and the timing is not comparable with the recording
+        '''
+        print(
+            f'Replayed {self.replayed}/{len(self.records)} calls '
+            f'in {time.time() - self.started:.2f}s, '
+            f'recorded session took {self.recorded_duration:.2f}s'
+        )
+        if self.unmatched:
+            print(f'{len(self.unmatched)} calls had no recorded match:')
+            for call in self.unmatched:
+                print(f'  {call}')
+        return not self.unmatched
@@ -1,12 +1,16 @@
+import re
+import sys
 import json
 import fire
 import yaml
 import boto3
+import botocore.exceptions
 import pathlib
 import functools
-from ebcli.lib import elasticbeanstalk
+from concurrent import futures
+from ebcli.lib import aws, elasticbeanstalk
 from ebcli.operations import commonops
-from elastictalk import utils, pipe
+from elastictalk import utils, pipe, secrets, recording, preflight
 
 
 eb = boto3.client('elasticbeanstalk')
@@ -18,6 +22,11 @@ rds_snapshot_waiter = rds.get_waiter('db_snapshot_completed')
 elasticache = boto3.client('elasticache')
 elasticache_available_waiter = elasticache.get_waiter('cache_cluster_available')
 elasticache_deleted_waiter = elasticache.get_waiter('cache_cluster_deleted')
+# Replayers created by ElasticTalk, main reports them after the command
+replayers = list()
+ssm = boto3.client('ssm')
+sts = boto3.client('sts')
+iam = boto3.client('iam')
 
 
 class ElasticTalk:
@@ -29,7 +38,10 @@ class ElasticTalk:
             self,
             app_name=None,
             env_name=None,
-            config_file='.elasticbeanstalk/config.yml'
+            config_file='.elasticbeanstalk/config.yml',
+            record_file=None,
+            replay_file=None,
+            replay_latency_scale=1.0,
     ):
         self.config_file = None
         if pathlib.Path(config_file).exists():
@@ -59,10 +71,50 @@ class ElasticTalk:
                 'Please give config.yml file path or app_name and env_name'
             )
         print(f'Use app_name={self.app_name}, env_name={self.env_name}')
+        if record_file and replay_file:
+            raise Exception('Please give either record_file or replay_file')
+        if record_file:
+            self._attach_recording(recording.Recorder(record_file))
+            print(f'Recording AWS calls to {record_file}')
+        if replay_file:
+            replayer = recording.Replayer(
+                replay_file,
+                latency_scale=replay_latency_scale,
+            )
+            replayer.scale_polling_sleep()
+            self._attach_recording(replayer)
+            replayers.append(replayer)
+            print(
+                f'Replaying AWS calls from {replay_file} '
+                f'with latency scale {replay_latency_scale}'
+            )
+
+    def _attach_recording(self, recorder):
+        # boto3 clients are created already, ebcli clients are created from
+        # its botocore session on first call
+        for client in [eb, rds, elasticache, ssm, sts, iam]:
+            recorder.attach(client.meta.events)
+        recorder.attach(aws._get_botocore_session())
 
     def save_env_var(self, env_file=None):
         env_file = env_file or f'{self.env_name}.env.json'
         env_var = utils.get_env(self.app_name, self.env_name)
+        if pathlib.Path(env_file).exists():
+            # Keep references instead of writing their resolved values, the
+            # next build resolves and rewrites them again
+            saved_env_var = self.get_env_var_from_file(
+                env_file,
+                resolve_references=False,
+            )
+            reference_keys = [
+                key
+                for key, value in saved_env_var.items()
+                if key in env_var and secrets.parse_reference(value)
+            ]
+            for key in reference_keys:
+                env_var[key] = saved_env_var[key]
+            if reference_keys:
+                print(f'Kept references of {reference_keys} in {env_file}')
         with pathlib.Path(env_file).open('w') as saved_file:
             json.dump(env_var, saved_file)
         print(
@@ -70,18 +122,26 @@ class ElasticTalk:
             f' environment variables to {env_file}'
         )
 
-    def get_env_var_from_file(self, env_file: str = None):
+    def get_env_var_from_file(
+            self,
+            env_file: str = None,
+            resolve_references: bool = True,
+    ):
         env_file = env_file or f'{self.env_name}.env.json'
         if not pathlib.Path(env_file).exists():
-            raise(f'Cannot open file {env_file}, the env_file not found')
+            raise Exception(f'Cannot open file {env_file}, the env_file not found')
         with pathlib.Path(env_file).open() as saved_file:
             env_var = json.load(saved_file)
         print(f'Loaded data from {env_file}')
+        if resolve_references:
+            env_var = secrets.resolve_env_var_references(env_var, ssm)
         return env_var
 
     def update_eb_env(self, env_var, timeout=None):
         # Follow ebcli.operations.envvarops.setenv
         # Follow ebcli.operations.envvarops.create_environment_variables_list
+        # References are resolved here only, callers pass env_var as saved
+        env_var = secrets.resolve_env_var_references(env_var, ssm)
         env_var_list = utils.get_eb_env_from_dict(env_var)
         request_id = elasticbeanstalk.update_environment(
             self.env_name,
@@ -97,7 +157,10 @@ class ElasticTalk:
         print('Updated environment variables')
 
     def update_env_var_by_file(self, env_file, timeout=None):
-        env_var = self.get_env_var_from_file(env_file)
+        env_var = self.get_env_var_from_file(
+            env_file,
+            resolve_references=False,
+        )
         self.update_eb_env(env_var)
 
     def create_elasticache(
@@ -132,6 +195,206 @@ class ElasticTalk:
         )
         return cache_id
 
+    def preflight_staging_pipe(
+            self,
+            clone_from_env_name,
+            rds_id=None,
+            env_file=None,
+            cache_id=None,
+            rds_snapshot_id=None,
+            rds_snapshot_log_file=None,
+            rds_log_file_name=None,
+            elasticache_log_file_name=None,
+    ):
+        rds_id = rds_id or self.get_last_rds_id(rds_log_file_name)
+        rds_snapshot_id = rds_snapshot_id or self.get_last_snapshot_id(
+            rds_snapshot_log_file
+        )
+        cache_id = cache_id or self.get_last_cache_id(elasticache_log_file_name)
+        env_var = self.get_env_var_from_file(
+            env_file,
+            resolve_references=False,
+        )
+        self._preflight_staging_pipe(
+            clone_from_env_name,
+            rds_id,
+            rds_snapshot_id,
+            cache_id,
+            env_var,
+        )
+
+    def _preflight_staging_pipe(
+            self,
+            clone_from_env_name,
+            rds_id,
+            rds_snapshot_id,
+            cache_id,
+            env_var,
+    ):
+        """
+        Check resolved ids and the env_var loaded without resolving its
+        references, return env_var with references resolved
+        """
+        checks = dict()
+        resolved_env_var = futures.Future()
+
+        def check_env_references():
+            try:
+                resolved_env_var.set_result(secrets.resolve_env_var_references(
+                    env_var,
+                    ssm,
+                    verbose=False,
+                ))
+            except Exception as error:
+                resolved_env_var.set_exception(error)
+                raise
+            references = [
+                key
+                for key, value in env_var.items()
+                if secrets.parse_reference(value)
+            ]
+            return f'{len(references)} references resolved'
+
+        # Submitted after check_env_references, so it never waits on a
+        # check that is not running
+        def check_env_rewrites():
+            try:
+                resolved = resolved_env_var.result()
+            except Exception:
+                raise Exception('Cannot check rewrites of unresolved references')
+            if rds_id:
+                db_url_keys = utils.get_db_url_keys(resolved)
+                if not db_url_keys:
+                    raise Exception('No DATABASE_URL to point to the RDS')
+                for key in db_url_keys:
+                    if not re.match(utils.DB_URL_PATTERN, resolved[key]):
+                        raise Exception(f'Cannot parse {key} address')
+            if cache_id and not utils.get_cache_like_keys(resolved):
+                raise Exception('No cache address to point to the ElastiCache')
+            return f'{len(resolved)} environment variables'
+
+        checks['env references'] = check_env_references
+        checks['env rewrites'] = check_env_rewrites
+
+        def check_eb_environments():
+            response = eb.describe_environments(
+                ApplicationName=self.app_name,
+                EnvironmentNames=[clone_from_env_name, self.env_name],
+                IncludeDeleted=False,
+            )
+            statuses = {
+                environment['EnvironmentName']: environment['Status']
+                for environment in response['Environments']
+                if environment['Status'] != 'Terminated'
+            }
+            if clone_from_env_name not in statuses:
+                raise Exception(f'Source environment {clone_from_env_name} not found')
+            if self.env_name in statuses:
+                raise Exception(
+                    f'Environment {self.env_name} already exists '
+                    f'({statuses[self.env_name]})'
+                )
+            source_env_var = utils.get_env(self.app_name, clone_from_env_name)
+            return (
+                f'{clone_from_env_name} is {statuses[clone_from_env_name]} '
+                f'with {len(source_env_var)} environment variables'
+            )
+
+        checks['EB environments'] = check_eb_environments
+
+        if rds_id and rds_snapshot_id:
+            def check_rds_snapshot():
+                response = rds.describe_db_snapshots(
+                    DBSnapshotIdentifier=rds_snapshot_id,
+                )
+                status = response['DBSnapshots'][0]['Status']
+                if status != 'available':
+                    raise Exception(f'Snapshot {rds_snapshot_id} is {status}')
+                return f'{rds_snapshot_id} is available'
+
+            def check_rds_id_free():
+                try:
+                    rds.describe_db_instances(DBInstanceIdentifier=rds_id)
+                except rds.exceptions.DBInstanceNotFoundFault:
+                    return f'{rds_id} is free'
+                raise Exception(f'RDS {rds_id} already exists')
+
+            checks['RDS snapshot'] = check_rds_snapshot
+            checks['RDS id'] = check_rds_id_free
+        elif rds_id:
+            def check_rds_exists():
+                response = rds.describe_db_instances(DBInstanceIdentifier=rds_id)
+                return f'{rds_id} is {response["DBInstances"][-1]["DBInstanceStatus"]}'
+
+            checks['RDS instance'] = check_rds_exists
+
+        if cache_id:
+            def check_cache_id_free():
+                try:
+                    elasticache.describe_cache_clusters(CacheClusterId=cache_id)
+                except elasticache.exceptions.CacheClusterNotFoundFault:
+                    return f'{cache_id} is free'
+                raise Exception(f'ElastiCache {cache_id} already exists')
+
+            checks['ElastiCache id'] = check_cache_id_free
+
+        # RDS, ElastiCache and EB have no DryRun, simulate the caller policy
+        actions = ['elasticbeanstalk:CreateEnvironment']
+        if rds_id and rds_snapshot_id:
+            actions.append('rds:RestoreDBInstanceFromDBSnapshot')
+        if cache_id:
+            actions.append('elasticache:CreateCacheCluster')
+
+        def check_permissions():
+            caller_arn = sts.get_caller_identity()['Arn']
+            policy_source_arn = utils.get_policy_source_arn(caller_arn)
+            try:
+                response = iam.simulate_principal_policy(
+                    PolicySourceArn=policy_source_arn,
+                    ActionNames=actions,
+                )
+            except botocore.exceptions.ClientError as error:
+                raise preflight.PreflightSkip(
+                    f'Cannot simulate policy of {policy_source_arn}, roles '
+                    f'under a path are not found since the role ARN is '
+                    f'rebuilt without it: {error}'
+                )
+            denied = [
+                result['EvalActionName']
+                for result in response['EvaluationResults']
+                if result['EvalDecision'] != 'allowed'
+            ]
+            if denied:
+                raise Exception(f'{caller_arn} is not allowed to {denied}')
+            return f'{caller_arn} is allowed to {actions}'
+
+        checks['IAM permissions'] = check_permissions
+
+        print('Running preflight checks')
+        preflight.Preflight(checks).start()
+        env_var = resolved_env_var.result()
+
+        print('Execution plan:')
+        plan = list()
+        if rds_id and rds_snapshot_id:
+            plan.append(f'Restore RDS {rds_id} from snapshot {rds_snapshot_id}')
+        if rds_id:
+            plan.append(
+                f'Point {utils.get_db_url_keys(env_var)} to RDS {rds_id}'
+            )
+        if cache_id:
+            plan.append(f'Create ElastiCache {cache_id}')
+            plan.append(
+                f'Point {utils.get_cache_like_keys(env_var)} to ElastiCache {cache_id}'
+            )
+        plan.append(
+            f'Clone EB environment {clone_from_env_name} as {self.env_name} '
+            f'with {len(env_var)} environment variables'
+        )
+        for step, description in enumerate(plan, 1):
+            print(f'{step}. {description}')
+        return env_var
+
     def build_staging_pipe(
             self,
             clone_from_env_name,
@@ -143,15 +406,31 @@ class ElasticTalk:
             rds_snapshot_log_file=None,
             rds_log_file_name=None,
             elasticache_log_file_name=None,
+            skip_preflight=False,
     ):
-        # Get env variable from saved
-        env_var = self.get_env_var_from_file(env_file)
         # Create RDS from snapshot
         rds_id = rds_id or self.get_last_rds_id(rds_log_file_name)
         rds_snapshot_id = rds_snapshot_id or self.get_last_snapshot_id(
             rds_snapshot_log_file
         )
         cache_id = cache_id or self.get_last_cache_id(elasticache_log_file_name)
+        # Get env variable from saved
+        env_var = self.get_env_var_from_file(
+            env_file,
+            resolve_references=False,
+        )
+        # Check everything before starting long running jobs, preflight
+        # resolves references as one of its checks
+        if skip_preflight:
+            env_var = secrets.resolve_env_var_references(env_var, ssm)
+        else:
+            env_var = self._preflight_staging_pipe(
+                clone_from_env_name,
+                rds_id,
+                rds_snapshot_id,
+                cache_id,
+                env_var,
+            )
 
         if rds_id:
             jobs = list()
@@ -454,7 +733,12 @@ class ElasticTalk:
 
 
 def main():
-    fire.Fire(ElasticTalk)
+    try:
+        fire.Fire(ElasticTalk)
+    finally:
+        matched = [replayer.report() for replayer in replayers]
+    if not all(matched):
+        sys.exit(1)
 
 
 if __name__ == '__main__':
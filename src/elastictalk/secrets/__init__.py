@@ -0,0 +1,174 @@
+import re
+import time
+import typing
+import functools
+import threading
+from concurrent import futures
+
+
+SSM_PREFIX = 'ssm:'
+SECRETS_MANAGER_PREFIX = 'secretsmanager:'
+# Parameter Store can fetch Secrets Manager secrets through this path, so
+# both kinds of reference are resolved by the same GetParameters batches
+SECRETS_MANAGER_REFERENCE_PATH = '/aws/reference/secretsmanager/'
+REFERENCE_PATTERN = r'^(?P<path>[^:]+)(?::(?P<version>\d+))?$'
+GET_PARAMETERS_BATCH_SIZE = 10
+DEFAULT_TTL = 300
+DEFAULT_MAX_WORKERS = 8
+
+
+class SecretReferenceError(Exception):
+    pass
+
+
+class TTLCache:
+    '''
+    Thread safe in-process cache, entries expire after ttl seconds.
+    '''
+
+    def __init__(self, ttl: int = DEFAULT_TTL):
+        self.ttl = ttl
+        self._data = dict()
+        self._lock = threading.Lock()
+
+    def get(self, key: typing.Hashable):
+        with self._lock:
+            if key not in self._data:
+                return None
+            expire_at, value = self._data[key]
+            if expire_at < time.monotonic():
+                del self._data[key]
+                return None
+            return value
+
+    def set(self, key: typing.Hashable, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+cache = TTLCache()
+
+
+def parse_reference(
+        value: str,
+) -> typing.Optional[typing.Tuple[str, typing.Optional[str]]]:
+    '''
+    Parse `ssm:/path[:version]` or `secretsmanager:name` to
+    (parameter path, version), return None for plaintext value
+    '''
+    if not isinstance(value, str):
+        return None
+    if value.startswith(SSM_PREFIX):
+        reference = value[len(SSM_PREFIX):]
+        matched = re.match(REFERENCE_PATTERN, reference)
+        if not matched:
+            raise SecretReferenceError(f'Invalid SSM reference {value}')
+        return matched['path'], matched['version']
+    if value.startswith(SECRETS_MANAGER_PREFIX):
+        name = value[len(SECRETS_MANAGER_PREFIX):]
+        if not name or ':' in name:
+            raise SecretReferenceError(
+                f'Invalid Secrets Manager reference {value}'
+            )
+        return f'{SECRETS_MANAGER_REFERENCE_PATH}{name}', None
+    return None
+
+
+def get_parameter_name(path: str, version: typing.Optional[str]) -> str:
+    return f'{path}:{version}' if version else path
+
+
+def get_parameters(
+        ssm_client,
+        references: typing.List[typing.Tuple[str, typing.Optional[str]]],
+) -> typing.Dict[typing.Tuple[str, typing.Optional[str]], str]:
+    '''
+    Fetch one GetParameters batch, references over the batch size must be
+    split by the caller
+    '''
+    names = {
+        get_parameter_name(path, version): (path, version)
+        for path, version in references
+    }
+    response = ssm_client.get_parameters(
+        Names=list(names),
+        WithDecryption=True,
+    )
+    if response['InvalidParameters']:
+        raise SecretReferenceError(
+            f'Cannot resolve parameters {response["InvalidParameters"]}'
+        )
+    values = dict()
+    for parameter in response['Parameters']:
+        # Selector is returned as `:version` when requested with a version
+        name = parameter['Name'] + parameter.get('Selector', '')
+        values[names[name]] = parameter['Value']
+    return values
+
+
+def resolve_env_var_references(
+        env_var: dict,
+        ssm_client,
+        max_workers: int = DEFAULT_MAX_WORKERS,
+        ttl_cache: TTLCache = None,
+        verbose: bool = True,
+) -> dict:
+    '''
+    Replace `ssm:` and `secretsmanager:` references in env_var values with
+    the stored values, references missed in the cache are fetched by
+    concurrent GetParameters batches
+    '''
+    ttl_cache = ttl_cache or cache
+    references = {
+        key: parse_reference(value)
+        for key, value in env_var.items()
+    }
+    references = {
+        key: reference
+        for key, reference in references.items()
+        if reference
+    }
+    if not references:
+        return dict(env_var)
+
+    # Look up the cache once, entries may expire before substituting
+    resolved = dict()
+    for reference in set(references.values()):
+        value = ttl_cache.get(reference)
+        if value is not None:
+            resolved[reference] = value
+    missed = sorted(
+        set(references.values()) - set(resolved),
+        key=lambda reference: get_parameter_name(*reference),
+    )
+    batches = [
+        missed[index:index + GET_PARAMETERS_BATCH_SIZE]
+        for index in range(0, len(missed), GET_PARAMETERS_BATCH_SIZE)
+    ]
+    if batches:
+        with futures.ThreadPoolExecutor(
+                max_workers=min(max_workers, len(batches))
+        ) as executor:
+            for values in executor.map(
+                    functools.partial(get_parameters, ssm_client),
+                    batches,
+            ):
+                for reference, value in values.items():
+                    ttl_cache.set(reference, value)
+                    resolved[reference] = value
+
+    env_var = dict(env_var)
+    for key, reference in references.items():
+        value = resolved.get(reference)
+        if value is None:
+            raise SecretReferenceError(
+                f'Cannot resolve {key}: {env_var[key]}'
+            )
+        env_var[key] = value
+    if verbose:
+        print(f'Resolved {len(references)} environment variable references')
+    return env_var
@@ -0,0 +1,114 @@
+import unittest
+from .. import secrets
+
+
+class FakeSSMClient:
+    def __init__(self, invalid=None):
+        self.calls = list()
+        self.invalid = invalid or list()
+
+    def get_parameters(self, Names, WithDecryption):
+        self.calls.append(Names)
+        parameters = list()
+        for name in Names:
+            if name in self.invalid:
+                continue
+            path, _, version = name.partition(':')
+            parameter = {'Name': path, 'Value': f'value of {name}'}
+            if version:
+                parameter['Selector'] = f':{version}'
+            parameters.append(parameter)
+        return {
+            'Parameters': parameters,
+            'InvalidParameters': [
+                name for name in Names if name in self.invalid
+            ],
+        }
+
+
+class ParseReferenceTest(unittest.TestCase):
+    def test_plaintext(self):
+        self.assertIsNone(secrets.parse_reference('postgres://u:p@h:5432/db'))
+        self.assertIsNone(secrets.parse_reference(1))
+
+    def test_ssm(self):
+        self.assertEqual(
+            secrets.parse_reference('ssm:/app/db_url'),
+            ('/app/db_url', None),
+        )
+        self.assertEqual(
+            secrets.parse_reference('ssm:/app/db_url:3'),
+            ('/app/db_url', '3'),
+        )
+
+    def test_secrets_manager(self):
+        self.assertEqual(
+            secrets.parse_reference('secretsmanager:app/key'),
+            (f'{secrets.SECRETS_MANAGER_REFERENCE_PATH}app/key', None),
+        )
+
+    def test_invalid(self):
+        for value in ['ssm:/app:latest', 'secretsmanager:', 'secretsmanager:a:b']:
+            with self.assertRaises(secrets.SecretReferenceError):
+                secrets.parse_reference(value)
+
+
+class GetParametersTest(unittest.TestCase):
+    def test_selector_mapping(self):
+        values = secrets.get_parameters(
+            FakeSSMClient(),
+            [('/a', None), ('/a', '2')],
+        )
+        self.assertEqual(values, {
+            ('/a', None): 'value of /a',
+            ('/a', '2'): 'value of /a:2',
+        })
+
+    def test_invalid_parameters(self):
+        with self.assertRaises(secrets.SecretReferenceError):
+            secrets.get_parameters(
+                FakeSSMClient(invalid=['/missing']),
+                [('/missing', None)],
+            )
+
+
+class ResolveEnvVarReferencesTest(unittest.TestCase):
+    def setUp(self):
+        self.env_var = {f'KEY_{index}': f'ssm:/app/{index}' for index in range(27)}
+        self.env_var['PLAIN'] = 'plain'
+
+    def test_batches_and_cache(self):
+        client = FakeSSMClient()
+        ttl_cache = secrets.TTLCache()
+        resolved = secrets.resolve_env_var_references(
+            self.env_var,
+            client,
+            ttl_cache=ttl_cache,
+            verbose=False,
+        )
+        self.assertEqual(
+            sorted(len(names) for names in client.calls),
+            [7, 10, 10],
+        )
+        self.assertEqual(resolved['KEY_0'], 'value of /app/0')
+        self.assertEqual(resolved['PLAIN'], 'plain')
+
+        secrets.resolve_env_var_references(
+            self.env_var,
+            client,
+            ttl_cache=ttl_cache,
+            verbose=False,
+        )
+        self.assertEqual(len(client.calls), 3)
+
+    def test_expired_cache(self):
+        client = FakeSSMClient()
+        ttl_cache = secrets.TTLCache(ttl=-1)
+        for _ in range(2):
+            secrets.resolve_env_var_references(
+                self.env_var,
+                client,
+                ttl_cache=ttl_cache,
+                verbose=False,
+            )
+        self.assertEqual(len(client.calls), 6)
@@ -13,6 +13,8 @@ from ebcli.operations import cloneops
 
 DB_URL_PATTERN = \
     r'(?P<connection_info>.*)@(?P<address>.*):(?P<port_slash_db>.*)'
+ASSUMED_ROLE_ARN_PATTERN = \
+    r'arn:(?P<partition>[^:]*):sts::(?P<account>\d+):assumed-role/(?P<role>[^/]+)/.*'
 
 
 def set_last_id_to_file(file_name: str, id_: str) -> None:
@@ -63,6 +65,20 @@ def eb_clone(
     )
 
 
+def get_policy_source_arn(caller_arn: str) -> str:
+    '''
+    IAM policy simulation needs the role ARN instead of the assumed role
+    session ARN returned by sts get_caller_identity
+    '''
+    assumed_role = re.match(ASSUMED_ROLE_ARN_PATTERN, caller_arn)
+    if not assumed_role:
+        return caller_arn
+    return (
+        f'arn:{assumed_role["partition"]}:iam::{assumed_role["account"]}'
+        f':role/{assumed_role["role"]}'
+    )
+
+
 def now_string(datetime_format: str = None):
     datetime_format = datetime_format or '%Y-%m-%d-%H-%M-%S'
     return datetime.datetime.now().strftime(datetime_format)
@@ -108,29 +124,40 @@ def get_input_boolean(message):
             return input_bool
 
 
+def get_cache_like_keys(env_var: dict) -> typing.List[str]:
+    return [
+        key
+        for key, val in env_var.items()
+        if 'cache.amazonaws.com' in val
+    ]
+
+
+def get_db_url_keys(env_var: dict) -> typing.List[str]:
+    return [key for key in env_var.keys() if 'DATABASE_URL' in key]
+
+
 def update_env_cache_like(
         env_var: dict,
         cache_endpoint: dict
 ) -> dict:
     env_var = copy.deepcopy(env_var)
     cache_addr, cache_port = cache_endpoint['Address'], cache_endpoint['Port']
-    for key, val in env_var.items():
-        if 'cache.amazonaws.com' in val:
-            new_val = []
-            for link in env_var[key].split(','):
-                new_link = f'{cache_addr}:{cache_port}' if ':' in link else cache_addr
-                change = get_input_boolean(
-                    f'Change {key}: {link} address to {new_link} (y/n)'
+    for key in get_cache_like_keys(env_var):
+        new_val = []
+        for link in env_var[key].split(','):
+            new_link = f'{cache_addr}:{cache_port}' if ':' in link else cache_addr
+            change = get_input_boolean(
+                f'Change {key}: {link} address to {new_link} (y/n)'
+            )
+            if change:
+                new_val.append(new_link)
+            else:
+                remove = get_input_boolean(
+                    f'Remove {key}: {link} address (y/n)'
                 )
-                if change:
-                    new_val.append(new_link)
-                else:
-                    remove = get_input_boolean(
-                        f'Remove {key}: {link} address (y/n)'
-                    )
-                    if not remove:
-                        new_val.append(link)
-            env_var[key] = ','.join(new_val)
+                if not remove:
+                    new_val.append(link)
+        env_var[key] = ','.join(new_val)
     return env_var
 
 
@@ -139,10 +166,7 @@ def update_env_db_url(
         endpoint_addr: str,
 ) -> dict:
     env_var = copy.deepcopy(env_var)
-    db_like_keys = list(filter(
-        lambda key: 'DATABASE_URL' in key,
-        env_var.keys()
-    ))
+    db_like_keys = get_db_url_keys(env_var)
     for db_like_key in db_like_keys:
         database_url = env_var[db_like_key]
         change = get_input_boolean(